@@ -1,8 +1,50 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
+import re
+import io
+from dataclasses import dataclass
 from datetime import datetime
-import base64
+
+REPORT_COLUMNS = {'amount', 'transaction_id', 'date'}
+# Rows rendered per result table; the Excel report always has everything
+MAX_DISPLAY = 1000
+# Result column -> report heading
+MATCHED_COLUMNS = {
+    'amount': 'Amount',
+    'transaction_id_opera': 'Opera Transaction ID',
+    'transaction_id_pos': 'POS Transaction ID',
+    'date_opera': 'Date'
+}
+MISMATCH_COLUMNS = {
+    'amount_opera': 'Opera Amount',
+    'amount_pos': 'POS Amount',
+    'difference': 'Difference',
+    'transaction_id_opera': 'Opera Transaction ID',
+    'transaction_id_pos': 'POS Transaction ID'
+}
+NON_NUMERIC = re.compile(r'[^\d.\-]')
+
+@dataclass
+class Pairs:
+    """Paired Opera/POS rows as parallel arrays: row positions into each frame plus cents"""
+    opera_idx: np.ndarray
+    pos_idx: np.ndarray
+    amount_cents: np.ndarray
+    difference_cents: np.ndarray
+    
+    def __len__(self):
+        return len(self.opera_idx)
+
+@dataclass
+class Reconciliation:
+    """Reconciliation outcome as row positions into the parsed Opera and POS frames"""
+    opera: pd.DataFrame
+    pos: pd.DataFrame
+    matched: Pairs
+    amount_mismatch: Pairs
+    unmatched_opera: np.ndarray
+    unmatched_pos: np.ndarray
 
 def main():
     st.set_page_config(page_title="Hotel Transaction Reconciler", layout="wide")
@@ -45,26 +87,122 @@ def main():
 
     if opera_file and pos_file:
         try:
-            # Load Opera data
-            if opera_file.name.endswith('.xlsx'):
-                opera_df = pd.read_excel(opera_file)
-            else:
-                opera_df = pd.read_csv(opera_file)
-                
-            # Load POS data
-            if pos_file.name.endswith('.xlsx'):
-                pos_df = pd.read_excel(pos_file)
-            else:
-                pos_df = pd.read_csv(pos_file)
-            
             # Button to start reconciliation
+            files_sig = (opera_file.file_id, pos_file.file_id)
             if st.button("Reconcile Transactions"):
-                results = reconcile_transactions(opera_df, pos_df)
-                display_results(results)
+                st.session_state.results = reconcile_files(opera_file.getvalue(), opera_file.name,
+                                                           pos_file.getvalue(), pos_file.name)
+                st.session_state.files_sig = files_sig
+            
+            # Keep showing the last results across reruns (e.g. the download button)
+            # until different files are uploaded
+            if st.session_state.get('files_sig') == files_sig:
+                display_results(st.session_state.results)
                 
         except Exception as e:
             st.error(f"Error processing files: {str(e)}")
 
+def _is_report_column(col):
+    """Only the columns used for reconciliation are parsed from the uploads"""
+    return str(col).strip().lower() in REPORT_COLUMNS
+
+@st.cache_resource
+def _polars():
+    """Import Polars on the first CSV upload rather than at startup (None if not installed)"""
+    try:
+        import polars
+    except ImportError:
+        return None
+    return polars
+
+@st.cache_resource
+def _xlsxwriter():
+    """Import xlsxwriter only once a report is actually requested"""
+    import xlsxwriter
+    return xlsxwriter
+
+def _read_csv(data):
+    """Parse a CSV upload with Polars' multi-threaded reader when it is installed"""
+    pl = _polars()
+    if pl is None:
+        # Read as Arrow strings: inferring ints overflows on IDs wider than int64, and
+        # _to_amount parses the amounts anyway
+        return pd.read_csv(io.BytesIO(data), usecols=_is_report_column, dtype='string[pyarrow]')
+    header = pl.read_csv(io.BytesIO(data), n_rows=0).columns
+    # All columns as strings, like the pandas path: wide numeric IDs would otherwise be
+    # inferred as Int128, which has no Arrow equivalent for to_pandas
+    df = pl.read_csv(io.BytesIO(data), columns=[c for c in header if _is_report_column(c)],
+                     infer_schema=False)
+    return df.to_pandas(use_pyarrow_extension_array=True)
+
+@st.cache_data(show_spinner=False)
+def load_transactions(data, name):
+    """Parse an uploaded Opera/POS report (cached on the file contents)"""
+    # Excel stays on the default backend: Arrow cannot hold a column that mixes numeric
+    # and text cells (IDs like 12345 and A-7, amounts next to "$1,000.00")
+    if name.endswith('.xlsx'):
+        try:
+            df = pd.read_excel(io.BytesIO(data), engine='calamine', usecols=_is_report_column)
+        except ImportError:
+            # python-calamine not installed
+            df = pd.read_excel(io.BytesIO(data), engine='openpyxl', usecols=_is_report_column)
+    else:
+        df = _read_csv(data)
+    return _shrink(df)
+
+@st.cache_data(show_spinner=False)
+def reconcile_files(opera_data, opera_name, pos_data, pos_name):
+    """Load and reconcile both reports, cached so reruns skip the parse and the merge"""
+    return reconcile_transactions(load_transactions(opera_data, opera_name),
+                                  load_transactions(pos_data, pos_name))
+
+def _is_text(column):
+    """True if every non-null value is a string; mixed-type columns (datetimes plus a
+    "pending" cell, IDs like 12345 and A-7) cannot be rendered as categories"""
+    return pd.api.types.infer_dtype(column, skipna=True) == 'string'
+
+def _shrink(df):
+    """Store repeated text (dates, ID prefixes) as categories and downcast integer columns.
+    Float columns stay float64: amounts need full precision for the cents conversion."""
+    for col in df.select_dtypes(include=['object', 'string']).columns:
+        if _is_text(df[col]) and df[col].nunique() < len(df) / 2:
+            df[col] = df[col].astype('category')
+    for col in df.select_dtypes(include='integer').columns:
+        df[col] = pd.to_numeric(df[col], downcast='integer')
+    return df
+
+def _to_amount(amount):
+    """Parse amounts, only stripping currency symbols etc. from values that are not already numeric"""
+    # Plain float64 so unparseable values are NaN (Arrow doubles keep NaN apart from nulls)
+    values = pd.to_numeric(amount, errors='coerce').to_numpy(dtype='float64', na_value=np.nan, copy=True)
+    needs_cleanup = np.isnan(values) & amount.notna().to_numpy()
+    if needs_cleanup.any():
+        cleaned = amount[needs_cleanup].astype(str).str.replace(NON_NUMERIC, '', regex=True)
+        values[needs_cleanup] = pd.to_numeric(cleaned, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    return pd.Series(values, index=amount.index)
+
+def _to_cents(amount):
+    """Convert amounts to whole cents (nullable int64) so matching compares integers"""
+    amount = amount.astype('float64')
+    # Infinite amounts, or ones so large that the cents difference of two of them could
+    # overflow int64, go the unparseable -> unmatched way
+    amount = amount.where(np.isfinite(amount) & (amount.abs() < 4e16))
+    return amount.mul(100).round().astype('Int64')
+
+def _keyed(cents):
+    """Join keys for one side: row position, cents and the occurrence of that amount, so
+    repeated amounts pair off one-to-one; amounts that could not be parsed are left out"""
+    keys = pd.DataFrame({'row': np.arange(len(cents)), 'cents': cents.array}).dropna(subset=['cents'])
+    keys = keys.astype({'cents': 'int64'})
+    keys['occurrence'] = keys.groupby('cents').cumcount()
+    return keys
+
+def _unmatched(n_rows, matched_idx):
+    """Positions of the rows that are not part of any exact match (one pass over a mask)"""
+    unmatched = np.ones(n_rows, dtype=bool)
+    unmatched[matched_idx] = False
+    return np.flatnonzero(unmatched)
+
 def reconcile_transactions(opera_df, pos_df):
     """Reconcile transactions between Opera PMS and POS data"""
     
@@ -73,56 +211,86 @@ def reconcile_transactions(opera_df, pos_df):
     pos_df.columns = pos_df.columns.str.lower().str.strip()
     
     # Ensure amount columns are numeric
-    opera_df['amount'] = pd.to_numeric(opera_df['amount'].astype(str).str.replace('[^\d.-]', '', regex=True), errors='coerce')
-    pos_df['amount'] = pd.to_numeric(pos_df['amount'].astype(str).str.replace('[^\d.-]', '', regex=True), errors='coerce')
-    
-    # Initialize results dictionary
-    results = {
-        'matched': [],
-        'unmatched_opera': [],
-        'unmatched_pos': [],
-        'amount_mismatch': []
-    }
-    
-    # Create copy of dataframes for processing
-    opera_unmatched = opera_df.copy()
-    pos_unmatched = pos_df.copy()
-    
-    # Find exact matches
-    for _, opera_row in opera_df.iterrows():
-        match_found = False
+    opera_df['amount'] = _to_amount(opera_df['amount'])
+    pos_df['amount'] = _to_amount(pos_df['amount'])
+    
+    # Key both sides on whole cents so exact matching is a single hash join
+    opera_cents = _to_cents(opera_df['amount'])
+    pos_cents = _to_cents(pos_df['amount'])
+    
+    # Classify matched / Opera-only / POS-only rows with one outer merge
+    merged = _keyed(opera_cents).merge(_keyed(pos_cents), on=['cents', 'occurrence'], how='outer',
+                                       suffixes=('_opera', '_pos'), indicator=True)
+    
+    both = merged[merged['_merge'].eq('both')]
+    matched = Pairs(
+        opera_idx=both['row_opera'].to_numpy(dtype=np.int64),
+        pos_idx=both['row_pos'].to_numpy(dtype=np.int64),
+        amount_cents=both['cents'].to_numpy(dtype=np.int64),
+        difference_cents=np.zeros(len(both), dtype=np.int64)
+    )
+    opera_leftover = merged.loc[merged['_merge'].eq('left_only'), ['cents', 'row_opera']]
+    pos_leftover = merged.loc[merged['_merge'].eq('right_only'), ['cents', 'row_pos']]
+    unmatched_opera = _unmatched(len(opera_df), matched.opera_idx)
+    unmatched_pos = _unmatched(len(pos_df), matched.pos_idx)
+    
+    # Pair each leftover Opera amount with the nearest leftover POS amount by binary search
+    # over the sorted POS cents, then keep the pairs that are within 5% of the Opera amount
+    amount_mismatch = Pairs(*(np.empty(0, dtype=np.int64) for _ in range(4)))
+    if not opera_leftover.empty and not pos_leftover.empty:
+        opera_amounts = opera_leftover['cents'].to_numpy(dtype=np.int64)
+        order = np.argsort(pos_leftover['cents'].to_numpy(dtype=np.int64), kind='stable')
+        pos_amounts = pos_leftover['cents'].to_numpy(dtype=np.int64)[order]
+        pos_rows = pos_leftover['row_pos'].to_numpy(dtype=np.int64)[order]
         
-        for _, pos_row in pos_df.iterrows():
-            if abs(opera_row['amount'] - pos_row['amount']) < 0.01:  # Account for floating point
-                results['matched'].append({
-                    'opera': opera_row.to_dict(),
-                    'pos': pos_row.to_dict(),
-                    'amount': opera_row['amount']
-                })
-                
-                # Remove matched transactions from unmatched sets
-                opera_unmatched = opera_unmatched[opera_unmatched['amount'] != opera_row['amount']]
-                pos_unmatched = pos_unmatched[pos_unmatched['amount'] != pos_row['amount']]
-                
-                match_found = True
-                break
+        idx = np.searchsorted(pos_amounts, opera_amounts)
+        below = np.clip(idx - 1, 0, len(pos_amounts) - 1)
+        above = np.clip(idx, 0, len(pos_amounts) - 1)
+        nearest = np.where(np.abs(pos_amounts[below] - opera_amounts) <= np.abs(pos_amounts[above] - opera_amounts),
+                           below, above)
         
-        if not match_found:
-            # Look for similar amounts (within 5% difference)
-            for _, pos_row in pos_df.iterrows():
-                difference = abs(opera_row['amount'] - pos_row['amount'])
-                if difference > 0 and difference/opera_row['amount'] < 0.05:
-                    results['amount_mismatch'].append({
-                        'opera': opera_row.to_dict(),
-                        'pos': pos_row.to_dict(),
-                        'difference': difference
-                    })
-    
-    # Add remaining unmatched transactions
-    results['unmatched_opera'] = opera_unmatched.to_dict('records')
-    results['unmatched_pos'] = pos_unmatched.to_dict('records')
-    
-    return results
+        # Integer-only test: |difference| < 5% of the Opera amount, i.e. below
+        # ceil(|opera| / 20); dividing rather than multiplying cannot overflow
+        difference = np.abs(opera_amounts - pos_amounts[nearest])
+        close = (difference > 0) & (difference < -(-np.abs(opera_amounts) // 20))
+        amount_mismatch = Pairs(
+            opera_idx=opera_leftover['row_opera'].to_numpy(dtype=np.int64)[close],
+            pos_idx=pos_rows[nearest[close]],
+            amount_cents=opera_amounts[close],
+            difference_cents=difference[close]
+        )
+    
+    return Reconciliation(
+        opera=opera_df,
+        pos=pos_df,
+        matched=matched,
+        amount_mismatch=amount_mismatch,
+        unmatched_opera=unmatched_opera,
+        unmatched_pos=unmatched_pos
+    )
+
+def _report_table(df, columns):
+    """Select and label report columns; absent columns and blank text cells show as N/A"""
+    table = df.reindex(columns=list(columns), fill_value='N/A')
+    text = table.select_dtypes(include=['object', 'string', 'category']).columns
+    table[text] = table[text].astype(object).fillna('N/A')
+    return table.rename(columns=columns)
+
+def _pair_table(results, pairs, columns, limit=None):
+    """Materialize paired rows side by side (Opera columns suffixed _opera, POS _pos),
+    optionally only the first `limit` pairs"""
+    frame = pd.concat([
+        results.opera.iloc[pairs.opera_idx[:limit]].reset_index(drop=True).add_suffix('_opera'),
+        results.pos.iloc[pairs.pos_idx[:limit]].reset_index(drop=True).add_suffix('_pos')
+    ], axis=1).assign(amount=pairs.amount_cents[:limit] / 100,
+                      difference=pairs.difference_cents[:limit] / 100)
+    return _report_table(frame, columns)
+
+def _show_table(df, total):
+    """Render a (pre-truncated) result table, noting when rows were left out"""
+    st.dataframe(_shrink(df))
+    if total > MAX_DISPLAY:
+        st.caption(f"Showing first {MAX_DISPLAY:,} of {total:,} rows - download the report for all of them")
 
 def display_results(results):
     """Display reconciliation results in a user-friendly format"""
@@ -132,38 +300,27 @@ def display_results(results):
     # Summary statistics
     col1, col2, col3, col4 = st.columns(4)
     with col1:
-        st.metric("Matched Transactions", len(results['matched']))
+        st.metric("Matched Transactions", len(results.matched))
     with col2:
-        st.metric("Amount Mismatches", len(results['amount_mismatch']))
+        st.metric("Amount Mismatches", len(results.amount_mismatch))
     with col3:
-        st.metric("Unmatched Opera", len(results['unmatched_opera']))
+        st.metric("Unmatched Opera", len(results.unmatched_opera))
     with col4:
-        st.metric("Unmatched POS", len(results['unmatched_pos']))
+        st.metric("Unmatched POS", len(results.unmatched_pos))
     
     # Matched Transactions
     st.subheader("Matched Transactions")
-    if results['matched']:
-        matched_df = pd.DataFrame([{
-            'Amount': m['amount'],
-            'Opera Transaction ID': m['opera'].get('transaction_id', 'N/A'),
-            'POS Transaction ID': m['pos'].get('transaction_id', 'N/A'),
-            'Date': m['opera'].get('date', 'N/A')
-        } for m in results['matched']])
-        st.dataframe(matched_df)
+    if len(results.matched):
+        matched_df = _pair_table(results, results.matched, MATCHED_COLUMNS, limit=MAX_DISPLAY)
+        _show_table(matched_df, len(results.matched))
     else:
         st.write("No matched transactions found")
     
     # Amount Mismatches
     st.subheader("Amount Mismatches")
-    if results['amount_mismatch']:
-        mismatch_df = pd.DataFrame([{
-            'Opera Amount': m['opera']['amount'],
-            'POS Amount': m['pos']['amount'],
-            'Difference': m['difference'],
-            'Opera Transaction ID': m['opera'].get('transaction_id', 'N/A'),
-            'POS Transaction ID': m['pos'].get('transaction_id', 'N/A')
-        } for m in results['amount_mismatch']])
-        st.dataframe(mismatch_df)
+    if len(results.amount_mismatch):
+        mismatch_df = _pair_table(results, results.amount_mismatch, MISMATCH_COLUMNS, limit=MAX_DISPLAY)
+        _show_table(mismatch_df, len(results.amount_mismatch))
     else:
         st.write("No amount mismatches found")
     
@@ -172,15 +329,17 @@ def display_results(results):
     
     with col1:
         st.subheader("Unmatched Opera Transactions")
-        if results['unmatched_opera']:
-            st.dataframe(pd.DataFrame(results['unmatched_opera']))
+        if len(results.unmatched_opera):
+            _show_table(results.opera.iloc[results.unmatched_opera[:MAX_DISPLAY]],
+                        len(results.unmatched_opera))
         else:
             st.write("No unmatched Opera transactions")
     
     with col2:
         st.subheader("Unmatched POS Transactions")
-        if results['unmatched_pos']:
-            st.dataframe(pd.DataFrame(results['unmatched_pos']))
+        if len(results.unmatched_pos):
+            _show_table(results.pos.iloc[results.unmatched_pos[:MAX_DISPLAY]],
+                        len(results.unmatched_pos))
         else:
             st.write("No unmatched POS transactions")
     
@@ -188,37 +347,42 @@ def display_results(results):
     if st.button("Download Reconciliation Report"):
         generate_report(results)
 
+def _write_sheet(workbook, name, df):
+    """Write a frame row by row: in constant_memory mode rows cannot be revisited, so
+    pandas' column-by-column to_excel would lose all but the last row's cells"""
+    worksheet = workbook.add_worksheet(name)
+    worksheet.write_row(0, 0, [str(col) for col in df.columns])
+    values = df.astype(object).where(df.notna(), None)
+    for row, record in enumerate(values.itertuples(index=False, name=None), start=1):
+        worksheet.write_row(row, 0, record)
+
 def generate_report(results):
     """Generate and download Excel report"""
     buffer = io.BytesIO()
-    with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
-        # Matched transactions
-        matched_df = pd.DataFrame([{
-            'Amount': m['amount'],
-            'Opera Transaction ID': m['opera'].get('transaction_id', 'N/A'),
-            'POS Transaction ID': m['pos'].get('transaction_id', 'N/A'),
-            'Date': m['opera'].get('date', 'N/A')
-        } for m in results['matched']])
-        matched_df.to_excel(writer, sheet_name='Matched', index=False)
-        
-        # Amount mismatches
-        mismatch_df = pd.DataFrame([{
-            'Opera Amount': m['opera']['amount'],
-            'POS Amount': m['pos']['amount'],
-            'Difference': m['difference'],
-            'Opera Transaction ID': m['opera'].get('transaction_id', 'N/A'),
-            'POS Transaction ID': m['pos'].get('transaction_id', 'N/A')
-        } for m in results['amount_mismatch']])
-        mismatch_df.to_excel(writer, sheet_name='Mismatches', index=False)
-        
-        # Unmatched transactions
-        pd.DataFrame(results['unmatched_opera']).to_excel(writer, sheet_name='Unmatched Opera', index=False)
-        pd.DataFrame(results['unmatched_pos']).to_excel(writer, sheet_name='Unmatched POS', index=False)
+    # constant_memory flushes each row to disk once the next one starts, keeping memory
+    # bounded for large result sets
+    workbook = _xlsxwriter().Workbook(buffer, {
+        'constant_memory': True,
+        'default_date_format': 'yyyy-mm-dd',
+        # Unmatched rows may carry an infinite amount; write it as an Excel error cell
+        'nan_inf_to_errors': True
+    })
+    
+    # Matched transactions
+    _write_sheet(workbook, 'Matched', _pair_table(results, results.matched, MATCHED_COLUMNS))
+    
+    # Amount mismatches
+    _write_sheet(workbook, 'Mismatches', _pair_table(results, results.amount_mismatch, MISMATCH_COLUMNS))
+    
+    # Unmatched transactions
+    _write_sheet(workbook, 'Unmatched Opera', results.opera.iloc[results.unmatched_opera])
+    _write_sheet(workbook, 'Unmatched POS', results.pos.iloc[results.unmatched_pos])
+    workbook.close()
     
     # Download link
     st.download_button(
         label="Download Excel Report",
-        data=buffer,
+        data=buffer.getvalue(),
         file_name=f"reconciliation_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
         mime="application/vnd.ms-excel"
     )
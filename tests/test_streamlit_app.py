@@ -0,0 +1,211 @@
+import io
+
+import openpyxl
+import pandas as pd
+import pytest
+from streamlit.dataframe_util import convert_pandas_df_to_arrow_bytes
+
+import streamlit_app
+from streamlit_app import (MATCHED_COLUMNS, _pair_table, _shrink, load_transactions,
+                           reconcile_transactions)
+
+
+def _xlsx(df):
+    buffer = io.BytesIO()
+    df.to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+def test_excel_mixed_id_column():
+    opera = load_transactions(_xlsx(pd.DataFrame({
+        'Amount': [10, 20],
+        'Transaction_ID': [12345, 'A-7']
+    })), 'opera.xlsx')
+    pos = load_transactions(_xlsx(pd.DataFrame({
+        'amount': [10, 20],
+        'transaction_id': ['p1', 'p2']
+    })), 'pos.xlsx')
+    results = reconcile_transactions(opera, pos)
+    assert len(results.matched) == 2
+
+
+def test_excel_mixed_amount_column():
+    opera = load_transactions(_xlsx(pd.DataFrame({
+        'amount': [10, '$1,000.00', 'N/A'],
+        'transaction_id': ['o1', 'o2', 'o3']
+    })), 'opera.xlsx')
+    pos = load_transactions(_xlsx(pd.DataFrame({
+        'amount': [10, 1000],
+        'transaction_id': ['p1', 'p2']
+    })), 'pos.xlsx')
+    results = reconcile_transactions(opera, pos)
+    assert len(results.matched) == 2
+    assert results.unmatched_opera.tolist() == [2]
+
+
+def test_excel_repeated_mixed_values_render():
+    opera = load_transactions(_xlsx(pd.DataFrame({
+        'amount': [10, 20, 30, 40, 50, 60],
+        'transaction_id': [12345, 'A-7', 12345, 'A-7', 12345, 'A-7'],
+        'date': [pd.Timestamp('2024-01-01')] * 5 + ['pending']
+    })), 'opera.xlsx')
+    pos = load_transactions(_xlsx(pd.DataFrame({
+        'amount': [10, 20, 30],
+        'transaction_id': ['p1', 'p2', 'p3']
+    })), 'pos.xlsx')
+    results = reconcile_transactions(opera, pos)
+    # The same conversion st.dataframe performs in _show_table
+    convert_pandas_df_to_arrow_bytes(_shrink(_pair_table(results, results.matched, MATCHED_COLUMNS)))
+    convert_pandas_df_to_arrow_bytes(_shrink(results.opera.iloc[results.unmatched_opera]))
+
+
+def test_csv_blank_id_column_pandas(monkeypatch):
+    monkeypatch.setattr(streamlit_app, '_polars', lambda: None)
+    opera = _shrink(streamlit_app._read_csv(b'amount,transaction_id\n10,\n20,\n30,\n'))
+    results = reconcile_transactions(opera, pd.DataFrame({'amount': [10, 20]}))
+    assert len(results.matched) == 2
+    convert_pandas_df_to_arrow_bytes(_shrink(results.opera.iloc[results.unmatched_opera]))
+
+
+def test_excel_blank_id_column():
+    opera = load_transactions(_xlsx(pd.DataFrame({
+        'amount': [10, 20],
+        'transaction_id': [None, None]
+    })), 'opera.xlsx')
+    pos = load_transactions(_xlsx(pd.DataFrame({
+        'amount': [10, 20],
+        'transaction_id': ['p1', 'p2']
+    })), 'pos.xlsx')
+    assert len(reconcile_transactions(opera, pos).matched) == 2
+
+
+WIDE_ID_CSV = (b'amount,transaction_id\n'
+               b'10.00,123456789012345678901\n'
+               b'$20.00,123456789012345678902\n')
+
+
+def test_csv_wide_id_column_pandas(monkeypatch):
+    monkeypatch.setattr(streamlit_app, '_polars', lambda: None)
+    df = streamlit_app._read_csv(WIDE_ID_CSV)
+    assert df['transaction_id'].tolist() == ['123456789012345678901', '123456789012345678902']
+    results = reconcile_transactions(df, pd.DataFrame({'amount': [10, 20]}))
+    assert len(results.matched) == 2
+
+
+def test_csv_wide_id_column_polars():
+    pytest.importorskip('polars')
+    df = streamlit_app._read_csv(WIDE_ID_CSV)
+    assert df['transaction_id'].tolist() == ['123456789012345678901', '123456789012345678902']
+    results = reconcile_transactions(df, pd.DataFrame({'amount': [10, 20]}))
+    assert len(results.matched) == 2
+
+
+def test_non_finite_and_huge_amounts_are_unmatched():
+    opera = pd.DataFrame({'amount': ['inf', '-inf', '1e20', '5']})
+    pos = pd.DataFrame({'amount': [5, float('inf')]})
+    results = reconcile_transactions(opera, pos)
+    assert len(results.matched) == 1
+    assert results.unmatched_opera.tolist() == [0, 1, 2]
+    assert results.unmatched_pos.tolist() == [1]
+
+
+def test_large_amounts_do_not_overflow_mismatch_test():
+    opera = pd.DataFrame({'amount': [6e15, 3.9e16, 3e16, 8e16]})
+    pos = pd.DataFrame({'amount': [1e15, -3.9e16, 3.1e16, -8e16]})
+    results = reconcile_transactions(opera, pos)
+    mismatch = results.amount_mismatch
+    # Only 3e16 vs 3.1e16 (3.2%) is within 5%; 8e16 is out of range on both sides
+    assert mismatch.opera_idx.tolist() == [2]
+    assert mismatch.pos_idx.tolist() == [2]
+    assert mismatch.difference_cents.tolist() == [10 ** 17]
+    assert 3 in results.unmatched_opera and 3 in results.unmatched_pos
+
+
+def _reconcile(opera_amounts, pos_amounts):
+    return reconcile_transactions(pd.DataFrame({'amount': opera_amounts}),
+                                  pd.DataFrame({'amount': pos_amounts}))
+
+
+def test_repeated_amounts_pair_one_to_one():
+    results = _reconcile([1, 1, 1], [1, 1])
+    assert results.matched.opera_idx.tolist() == [0, 1]
+    assert results.matched.pos_idx.tolist() == [0, 1]
+    assert results.unmatched_opera.tolist() == [2]
+    assert results.unmatched_pos.tolist() == []
+
+
+def test_mismatch_must_be_strictly_within_five_percent():
+    assert len(_reconcile([100], [105]).amount_mismatch) == 0
+    mismatch = _reconcile([100], [104.99]).amount_mismatch
+    assert mismatch.difference_cents.tolist() == [499]
+
+
+def test_mismatch_negative_amounts():
+    assert _reconcile([-100], [-103]).amount_mismatch.difference_cents.tolist() == [300]
+    assert len(_reconcile([-100], [100]).amount_mismatch) == 0
+
+
+def test_mismatch_tie_takes_lower_pos_amount():
+    mismatch = _reconcile([100], [102, 98]).amount_mismatch
+    assert mismatch.pos_idx.tolist() == [1]
+    assert mismatch.difference_cents.tolist() == [200]
+
+
+def test_mismatch_opera_rows_can_share_a_pos_row():
+    mismatch = _reconcile([100, 101], [102]).amount_mismatch
+    assert mismatch.opera_idx.tolist() == [0, 1]
+    assert mismatch.pos_idx.tolist() == [0, 0]
+
+
+def test_unparseable_amounts_stay_unmatched():
+    results = _reconcile(['abc', None, '10'], ['abc', None, 10])
+    assert results.matched.opera_idx.tolist() == [2]
+    assert results.unmatched_opera.tolist() == [0, 1]
+    assert results.unmatched_pos.tolist() == [0, 1]
+    assert len(results.amount_mismatch) == 0
+
+
+def test_generate_report_writes_every_cell(monkeypatch):
+    downloads = []
+    monkeypatch.setattr(streamlit_app.st, 'download_button', lambda **kwargs: downloads.append(kwargs))
+    opera = pd.DataFrame({
+        'amount': [10, 20, 'inf', 50],
+        'transaction_id': ['o1', 'o2', 'o3', 'o4'],
+        'date': pd.to_datetime(['2024-01-01', None, '2024-01-03', '2024-01-04'])
+    })
+    pos = pd.DataFrame({'amount': [10, 20.5, 7], 'transaction_id': ['p1', 'p2', 'p3']})
+    streamlit_app.generate_report(reconcile_transactions(opera, pos))
+    data = downloads[0]['data']
+    sheets = pd.read_excel(io.BytesIO(data), sheet_name=None, engine='openpyxl')
+    assert list(sheets) == ['Matched', 'Mismatches', 'Unmatched Opera', 'Unmatched POS']
+    expected = {
+        'Matched': pd.DataFrame({
+            'Amount': [10],
+            'Opera Transaction ID': ['o1'],
+            'POS Transaction ID': ['p1'],
+            'Date': pd.to_datetime(['2024-01-01'])
+        }),
+        'Mismatches': pd.DataFrame({
+            'Opera Amount': [20],
+            'POS Amount': [20.5],
+            'Difference': [0.5],
+            'Opera Transaction ID': ['o2'],
+            'POS Transaction ID': ['p2']
+        }),
+        # The infinite amount is an error cell, read back as NaN
+        'Unmatched Opera': pd.DataFrame({
+            'amount': [20, float('nan'), 50],
+            'transaction_id': ['o2', 'o3', 'o4'],
+            'date': pd.to_datetime([None, '2024-01-03', '2024-01-04'])
+        }),
+        'Unmatched POS': pd.DataFrame({
+            'amount': [20.5, 7],
+            'transaction_id': ['p2', 'p3']
+        })
+    }
+    for name, frame in expected.items():
+        pd.testing.assert_frame_equal(sheets[name], frame, check_dtype=False)
+
+    # xlsxwriter's nan_inf_to_errors writes infinity as a =1/0 error formula
+    sheet = openpyxl.load_workbook(io.BytesIO(data))['Unmatched Opera']
+    assert sheet['A3'].value == '=1/0'